@@ -1,13 +1,33 @@
 import os
-import json
+import re
+import time
+import queue
+import signal
 import asyncio
+import logging
+import functools
+from collections import Counter
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
+import orjson
 from aiohttp import web
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 import gspread
+from gspread.utils import rowcol_to_a1
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from telegram import (
+    BotCommand,
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -18,9 +38,29 @@ from telegram.ext import (
     CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
+    InvalidCallbackData,
+    PersistenceInput,
+    PicklePersistence,
     filters,
 )
 
+# =========================
+# Logging
+# =========================
+
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+)
+_log_records = queue.SimpleQueue()
+_log_listener = QueueListener(_log_records, _log_stream)
+_log_listener.start()
+
+logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[QueueHandler(_log_records)])
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+log = logging.getLogger(__name__)
+
 # =========================
 # Google Sheets setup
 # =========================
@@ -28,17 +68,69 @@ from telegram.ext import (
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
 creds = Credentials.from_service_account_info(
-    json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"]),
+    orjson.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"]),
     scopes=SCOPES,
 )
 
 gc = gspread.authorize(creds)
+gc.http_client.session.mount("https://", HTTPAdapter(
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503],
+        raise_on_status=False,
+    ),
+))
 
 spreadsheet = gc.open_by_key(os.environ["SHEET_ID"])
 summary = spreadsheet.worksheet("Summary")
 logs = spreadsheet.worksheet("Logs")
 
-HEADERS = summary.row_values(1)
+HEADERS = []
+PROCESS_COLUMNS = []
+_COL_INDEX = {}
+
+SUMMARY_COLUMNS = ("Client", "Project", "Item Description", "Tasks", "Completed", "Status (%)")
+
+CACHE_TTL = 30
+CACHE_REFRESH_INTERVAL = 25
+
+_sheet_cache = {
+    "ts": 0.0,
+    "rows": None,
+    "writes": 0,
+    "synced": 0,
+    "index": {},
+    "clients": {},
+    "projects": {},
+    "items": {},
+    "tasks": Counter(),
+    "completed": Counter(),
+}
+
+_SHEETS_POOL = ThreadPoolExecutor(max_workers=4)
+
+_cache_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+TOKEN_REFRESH_INTERVAL = 50 * 60
+
+WRITE_FLUSH_INTERVAL = 2
+
+_pending_writes = {}
+
+LOG_FLUSH_INTERVAL = 5
+LOG_BATCH_SIZE = 50
+
+LOG_QUEUE = asyncio.Queue()
+
+_pending_logs = []
+
+QTY_FILTER = filters.TEXT & ~filters.COMMAND
+QTY_RE = re.compile(r"\s*[+-]?\d+\s*")
+
+WEBHOOK_MAX_CONNECTIONS = 40
+MAX_CONCURRENT_UPDATES = 64
 
 # =========================
 # Helpers
@@ -53,92 +145,157 @@ def safe_int(v):
     except:
         return 0
 
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SHEETS_POOL, functools.partial(fn, *args, **kwargs))
+
+def _store_rows(values):
+    HEADERS[:] = values[0] if values else []
+    _COL_INDEX.clear()
+    _COL_INDEX.update({h: i + 1 for i, h in reversed(list(enumerate(HEADERS)))})
+    PROCESS_COLUMNS[:] = [h for h in HEADERS if h and h not in SUMMARY_COLUMNS and not is_plan(h)]
+    rows = [dict(zip(HEADERS, r)) for r in values[1:]]
+    index = {}
+    clients = {}
+    projects = {}
+    items = {}
+    tasks = Counter()
+    completed = Counter()
+    for i, r in enumerate(rows, start=2):
+        key = (norm(r.get("Client")), norm(r.get("Project")), norm(r.get("Item Description")))
+        index.setdefault(key, i)
+        if key[0]:
+            clients.setdefault(key[0], str(r.get("Client")).strip())
+        if key[1]:
+            projects.setdefault(key[0], {}).setdefault(key[1], str(r.get("Project")).strip())
+        if key[2]:
+            items.setdefault(key[:2], {}).setdefault(key[2], str(r.get("Item Description")).strip())
+        tasks[key[:2]] += safe_int(r.get("Tasks"))
+        completed[key[:2]] += safe_int(r.get("Completed"))
+    for (row, col), value in _pending_writes.items():
+        if row - 2 < len(rows) and col <= len(HEADERS):
+            rows[row - 2][HEADERS[col - 1]] = str(value)
+    _sheet_cache["rows"] = rows
+    _sheet_cache["index"] = index
+    _sheet_cache["clients"] = clients
+    _sheet_cache["projects"] = projects
+    _sheet_cache["items"] = items
+    _sheet_cache["tasks"] = tasks
+    _sheet_cache["completed"] = completed
+    _sheet_cache["ts"] = time.monotonic()
+
+def _cache_expired(ttl, fresh):
+    return (
+        _sheet_cache["rows"] is None
+        or time.monotonic() - _sheet_cache["ts"] > ttl
+        or (fresh and _sheet_cache["writes"] != _sheet_cache["synced"])
+    )
+
+async def _get_rows_cached(ttl=CACHE_TTL, fresh=False):
+    if _cache_expired(ttl, fresh):
+        async with _cache_lock:
+            if _cache_expired(ttl, fresh):
+                writes = _sheet_cache["writes"]
+                _store_rows(await _run(summary.get_all_values))
+                _sheet_cache["synced"] = writes
+                if _sheet_cache["writes"] != writes:
+                    # a write landed mid-fetch and is missing from this snapshot
+                    _sheet_cache["ts"] = 0.0
+    return _sheet_cache["rows"]
+
+def set_cell(row, process, value):
+    if _sheet_cache["rows"] is not None:
+        cached_record(row)[process] = str(value)
+    _pending_writes[(row, col_index(process))] = value
+    _sheet_cache["writes"] += 1
+
 def col_index(col):
-    return HEADERS.index(col) + 1
+    return _COL_INDEX[col]
 
 def is_plan(col):
     return col.lower().endswith("plan")
 
-def actual_columns():
-    return [
-        h for h in HEADERS
-        if h not in ("Client", "Project", "Item Description", "Tasks", "Completed", "Status (%)")
-        and not is_plan(h)
-    ]
-
-def find_row(client, project, item):
-    for i, r in enumerate(summary.get_all_records(), start=2):
-        if (
-            norm(r.get("Client")) == norm(client)
-            and norm(r.get("Project")) == norm(project)
-            and norm(r.get("Item Description")) == norm(item)
-        ):
-            return i
-    return None
+async def find_row(client, project, item):
+    await _get_rows_cached()
+    return _sheet_cache["index"].get((norm(client), norm(project), norm(item)))
 
-def find_last_filled_process(row):
-    for col in reversed(actual_columns()):
-        if safe_int(summary.cell(row, col_index(col)).value) > 0:
+def cached_record(row):
+    return _sheet_cache["rows"][row - 2]
+
+def find_last_filled_process(record):
+    for col in reversed(PROCESS_COLUMNS):
+        if safe_int(record.get(col)) > 0:
             return col
     return None
 
+# =========================
+# Flow State
+# =========================
+
+@dataclass(slots=True)
+class FlowState:
+    client: str = ""
+    project: str = ""
+    item: str = ""
+    process: str = ""
+    edit_mode: bool = False
+
+def flow(context):
+    return context.user_data.setdefault("s", FlowState())
+
 # =========================
 # UI Screens
 # =========================
 
+@functools.lru_cache(maxsize=64)
+def choice_markup(kind, choices, back=None):
+    kb = [[InlineKeyboardButton(c, callback_data=(kind, c))] for c in choices]
+    if back:
+        kb.append([InlineKeyboardButton("⬅ Back", callback_data=back)])
+    return InlineKeyboardMarkup(kb)
+
 async def show_clients(update, edit=False):
-    clients = sorted({
-        r["Client"] for r in summary.get_all_records() if r.get("Client")
-    })
-    kb = [[InlineKeyboardButton(c, callback_data=f"client|{c}")] for c in clients]
+    await _get_rows_cached()
+    clients = tuple(_sheet_cache["clients"].values())
+    markup = choice_markup("client", clients)
 
     if edit:
         await update.effective_message.edit_text(
             "📁 Select Client",
-            reply_markup=InlineKeyboardMarkup(kb),
+            reply_markup=markup,
         )
     else:
         await update.message.reply_text(
             "📁 Select Client",
-            reply_markup=InlineKeyboardMarkup(kb),
+            reply_markup=markup,
         )
 
 async def show_projects(update, context):
-    client = context.user_data["client"]
-    projects = sorted({
-        r["Project"] for r in summary.get_all_records()
-        if norm(r.get("Client")) == norm(client)
-    })
-
-    kb = [[InlineKeyboardButton(p, callback_data=f"project|{p}")] for p in projects]
-    kb.append([InlineKeyboardButton("⬅ Back", callback_data="back_clients")])
+    client = flow(context).client
+    await _get_rows_cached()
+    projects = tuple(_sheet_cache["projects"].get(norm(client), {}).values())
 
     await update.effective_message.edit_text(
         f"📂 Client: {client}",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=choice_markup("project", projects, "back_clients"),
     )
 
 async def show_items(update, context):
-    client = context.user_data["client"]
-    project = context.user_data["project"]
+    s = flow(context)
+    client, project = s.client, s.project
 
-    items = sorted({
-        r["Item Description"] for r in summary.get_all_records()
-        if norm(r.get("Client")) == norm(client)
-        and norm(r.get("Project")) == norm(project)
-    })
-
-    kb = [[InlineKeyboardButton(i, callback_data=f"item|{i}")] for i in items]
-    kb.append([InlineKeyboardButton("⬅ Back", callback_data="back_projects")])
+    await _get_rows_cached()
+    items = tuple(_sheet_cache["items"].get((norm(client), norm(project)), {}).values())
 
     await update.effective_message.edit_text(
         f"📦 Project: {project}",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=choice_markup("item", items, "back_projects"),
     )
 
-async def show_processes(update, context):
-    kb = [[InlineKeyboardButton(p.replace(" ", ""), callback_data=f"proc|{p}")]
-          for p in actual_columns()]
+@functools.lru_cache(maxsize=4)
+def process_markup(processes):
+    kb = [[InlineKeyboardButton(p.replace(" ", ""), callback_data=("proc", p))]
+          for p in processes]
 
     kb.append([
         InlineKeyboardButton("📦 Item %", callback_data="item_status"),
@@ -148,20 +305,24 @@ async def show_processes(update, context):
         InlineKeyboardButton("❌ Undo", callback_data="undo"),
         InlineKeyboardButton("⬅ Back", callback_data="back_items"),
     ])
+    return InlineKeyboardMarkup(kb)
 
+QTY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Edit Qty", callback_data="edit_qty")],
+    [InlineKeyboardButton("⬅ Back", callback_data="back_processes")],
+])
+
+async def show_processes(update, context):
+    await _get_rows_cached()
     await update.effective_message.edit_text(
         "⚙ Select Process",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=process_markup(tuple(PROCESS_COLUMNS)),
     )
 
 async def ask_quantity(update, context):
-    kb = [
-        [InlineKeyboardButton("🔄 Edit Qty", callback_data="edit_qty")],
-        [InlineKeyboardButton("⬅ Back", callback_data="back_processes")],
-    ]
     await update.effective_message.edit_text(
-        f"✏ Enter quantity for {context.user_data['process']}",
-        reply_markup=InlineKeyboardMarkup(kb),
+        f"✏ Enter quantity for {flow(context).process}",
+        reply_markup=QTY_MARKUP,
     )
 
 # =========================
@@ -174,77 +335,86 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    await q.answer(cache_time=2)
     data = q.data
+    kind, value = data if isinstance(data, tuple) else (data, None)
+    s = flow(context)
 
-    if data.startswith("client|"):
-        context.user_data["client"] = data.split("|")[1]
+    if kind == "client":
+        s.client = value
         await show_projects(update, context)
 
-    elif data.startswith("project|"):
-        context.user_data["project"] = data.split("|")[1]
+    elif kind == "project":
+        s.project = value
         await show_items(update, context)
 
-    elif data.startswith("item|"):
-        context.user_data["item"] = data.split("|")[1]
+    elif kind == "item":
+        s.item = value
         await show_processes(update, context)
 
-    elif data.startswith("proc|"):
-        context.user_data["process"] = data.split("|")[1]
+    elif kind == "proc":
+        s.process = value
         await ask_quantity(update, context)
 
-    elif data == "edit_qty":
-        context.user_data["edit_mode"] = True
+    elif kind == "edit_qty":
+        s.edit_mode = True
         await update.effective_message.edit_text("🔄 Enter corrected quantity:")
 
-    elif data == "undo":
+    elif kind == "undo":
         await undo_last(update, context)
 
-    elif data == "item_status":
+    elif kind == "item_status":
         await show_item_status(update, context)
 
-    elif data == "project_status":
+    elif kind == "project_status":
         await show_project_status(update, context)
 
-    elif data == "back_clients":
+    elif kind == "back_clients":
         await show_clients(update, edit=True)
 
-    elif data == "back_projects":
+    elif kind == "back_projects":
         await show_projects(update, context)
 
-    elif data == "back_items":
+    elif kind == "back_items":
         await show_items(update, context)
 
-    elif data == "back_processes":
+    elif kind == "back_processes":
         await show_processes(update, context)
 
+async def expired_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer("⌛ This menu has expired")
+    context.user_data.clear()
+    await show_clients(update, edit=True)
+
 # =========================
 # Quantity Input
 # =========================
 
 async def quantity_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        qty = int(update.message.text)
-    except:
+    text = update.message.text
+    if not QTY_RE.fullmatch(text):
         await update.message.reply_text("❌ Enter a valid number")
         return
+    qty = int(text)
 
-    client = context.user_data["client"]
-    project = context.user_data["project"]
-    item = context.user_data["item"]
-    process = context.user_data["process"]
+    s = context.user_data.get("s")
+    if s is None or not s.process:
+        return
+
+    client, project, item, process = s.client, s.project, s.item, s.process
 
-    row = find_row(client, project, item)
-    col = col_index(process)
+    row = await find_row(client, project, item)
+    edit_mode, s.edit_mode = s.edit_mode, False
 
-    if context.user_data.pop("edit_mode", False):
-        summary.update_cell(row, col, qty)
+    if edit_mode:
+        value = qty
     else:
-        current = safe_int(summary.cell(row, col).value)
-        summary.update_cell(row, col, current + qty)
+        await _get_rows_cached()
+        value = safe_int(cached_record(row).get(process)) + qty
+    set_cell(row, process, value)
 
-    logs.append_row([
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    LOG_QUEUE.put_nowait([
+        datetime.now().isoformat(sep=" ", timespec="seconds"),
         update.effective_user.username,
         client,
         project,
@@ -259,15 +429,15 @@ async def quantity_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =========================
 
 async def show_item_status(update, context):
-    row = find_row(
-        context.user_data["client"],
-        context.user_data["project"],
-        context.user_data["item"],
-    )
+    await flush_writes(split=False)
+    await _get_rows_cached(fresh=True)
+    s = flow(context)
+    row = await find_row(s.client, s.project, s.item)
 
-    tasks = safe_int(summary.cell(row, col_index("Tasks")).value)
-    completed = safe_int(summary.cell(row, col_index("Completed")).value)
-    status = summary.cell(row, col_index("Status (%)")).value
+    record = cached_record(row)
+    tasks = safe_int(record.get("Tasks"))
+    completed = safe_int(record.get("Completed"))
+    status = record.get("Status (%)")
 
     await update.effective_message.edit_text(
         f"📦 Item Status\n\n"
@@ -277,17 +447,14 @@ async def show_item_status(update, context):
     )
 
 async def show_project_status(update, context):
-    client = context.user_data["client"]
-    project = context.user_data["project"]
-
-    records = summary.get_all_records()
-    total_tasks = 0
-    total_completed = 0
+    s = flow(context)
+    client, project = s.client, s.project
 
-    for r in records:
-        if norm(r.get("Client")) == norm(client) and norm(r.get("Project")) == norm(project):
-            total_tasks += safe_int(r.get("Tasks"))
-            total_completed += safe_int(r.get("Completed"))
+    await flush_writes(split=False)
+    await _get_rows_cached(fresh=True)
+    key = (norm(client), norm(project))
+    total_tasks = _sheet_cache["tasks"][key]
+    total_completed = _sheet_cache["completed"][key]
 
     percent = (total_completed / total_tasks * 100) if total_tasks else 0
 
@@ -305,42 +472,157 @@ async def show_project_status(update, context):
 # =========================
 
 async def undo_last(update, context):
-    row = find_row(
-        context.user_data["client"],
-        context.user_data["project"],
-        context.user_data["item"],
-    )
+    s = flow(context)
+    row = await find_row(s.client, s.project, s.item)
 
-    last_proc = find_last_filled_process(row)
+    last_proc = find_last_filled_process(cached_record(row))
     if not last_proc:
         await update.effective_message.edit_text("❌ Nothing to undo")
         return
 
-    summary.update_cell(row, col_index(last_proc), 0)
+    set_cell(row, last_proc, 0)
     await update.effective_message.edit_text(f"❌ Undone: {last_proc}")
 
+# =========================
+# Background Tasks
+# =========================
+
+async def cache_refresher():
+    while True:
+        try:
+            await _get_rows_cached(ttl=0)
+        except Exception as e:
+            log.warning("Summary refresh failed: %s", e)
+        await asyncio.sleep(CACHE_REFRESH_INTERVAL)
+
+async def token_refresher():
+    while True:
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
+        try:
+            await _run(creds.refresh, Request())
+        except Exception as e:
+            log.warning("Token refresh failed: %s", e)
+
+async def _sleep_until(stop, delay):
+    try:
+        await asyncio.wait_for(stop.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+def _rejected(e):
+    return e.response.status_code == 400
+
+def _drop_write(cell, value):
+    if _pending_writes.get(cell) == value:
+        del _pending_writes[cell]
+
+async def _write_cells(batch):
+    await _run(
+        summary.batch_update,
+        [{"range": rowcol_to_a1(row, col), "values": [[value]]} for (row, col), value in batch.items()],
+        value_input_option="USER_ENTERED",
+    )
+    for cell, value in batch.items():
+        _drop_write(cell, value)
+    _sheet_cache["writes"] += 1
+
+async def flush_writes(split=True):
+    async with _write_lock:
+        if not _pending_writes:
+            return
+        batch = dict(_pending_writes)
+        try:
+            await _write_cells(batch)
+        except gspread.exceptions.APIError as e:
+            if not _rejected(e):
+                raise
+            if not split:
+                return
+            for cell, value in batch.items():
+                try:
+                    await _write_cells({cell: value})
+                except gspread.exceptions.APIError as e:
+                    if not _rejected(e):
+                        raise
+                    log.error("Dropping rejected write %s=%r: %s", rowcol_to_a1(*cell), value, e)
+                    _drop_write(cell, value)
+                    _sheet_cache["ts"] = 0.0
+
+async def write_flusher(stop):
+    while not stop.is_set():
+        await _sleep_until(stop, WRITE_FLUSH_INTERVAL)
+        try:
+            await flush_writes()
+        except Exception as e:
+            log.warning("Write flush failed, retrying: %s", e)
+
+async def flush_logs():
+    while len(_pending_logs) < LOG_BATCH_SIZE and not LOG_QUEUE.empty():
+        _pending_logs.append(LOG_QUEUE.get_nowait())
+    if _pending_logs:
+        await _run(logs.append_rows, list(_pending_logs))
+        _pending_logs.clear()
+
+async def log_flusher(stop):
+    while not stop.is_set():
+        await _sleep_until(stop, LOG_FLUSH_INTERVAL)
+        try:
+            await flush_logs()
+        except Exception as e:
+            log.warning("Log flush failed, retrying: %s", e)
+
 # =========================
 # Webhook / Server
 # =========================
 
 async def webhook(request):
     app = request.app["telegram_app"]
-    update = Update.de_json(await request.json(), app.bot)
-    await app.process_update(update)
+    data = orjson.loads(await request.read())
+    update = Update.de_json(data, app.bot)
+    app.bot.insert_callback_data(update)
+    await app.update_queue.put(update)
     return web.Response(text="OK")
 
+async def on_error(update, context):
+    log.error("Update failed: %s", update, exc_info=context.error)
+    if isinstance(update, Update) and update.effective_message:
+        await update.effective_message.reply_text("❌ Something went wrong, please try again")
+
 async def health(request):
     return web.Response(text="OK")
 
+async def ensure_webhook(bot):
+    webhook_url = f"{os.environ['RENDER_EXTERNAL_URL']}/{os.environ['TELEGRAM_TOKEN']}"
+    info = await bot.get_webhook_info()
+    if info.url != webhook_url or info.max_connections != WEBHOOK_MAX_CONNECTIONS:
+        await bot.set_webhook(webhook_url, max_connections=WEBHOOK_MAX_CONNECTIONS)
+
 async def main():
-    app = Application.builder().token(os.environ["TELEGRAM_TOKEN"]).build()
+    app = (
+        Application.builder()
+        .token(os.environ["TELEGRAM_TOKEN"])
+        .persistence(PicklePersistence(
+            os.environ.get("STATE_FILE", "state.pkl"),
+            store_data=PersistenceInput(bot_data=False, chat_data=False),
+        ))
+        .arbitrary_callback_data(True)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        .pool_timeout(10)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CallbackQueryHandler(expired_button, pattern=InvalidCallbackData))
     app.add_handler(CallbackQueryHandler(buttons))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, quantity_input))
+    app.add_handler(MessageHandler(QTY_FILTER, quantity_input))
+    app.add_error_handler(on_error)
 
-    await app.initialize()
-    await app.start()
+    stop = asyncio.Event()
+
+    loader = asyncio.create_task(cache_refresher())
+    writer = asyncio.create_task(write_flusher(stop))
+    flusher = asyncio.create_task(log_flusher(stop))
+    refresher = asyncio.create_task(token_refresher())
 
     web_app = web.Application()
     web_app["telegram_app"] = app
@@ -348,19 +630,48 @@ async def main():
     web_app.router.add_post(f"/{os.environ['TELEGRAM_TOKEN']}", webhook)
 
     runner = web.AppRunner(web_app)
-    await runner.setup()
-    await web.TCPSite(
+    await asyncio.gather(app.initialize(), runner.setup())
+
+    site = web.TCPSite(
         runner,
         "0.0.0.0",
         int(os.environ.get("PORT", 10000)),
-    ).start()
+    )
+    await asyncio.gather(app.start(), site.start())
 
-    await app.bot.set_webhook(
-        f"{os.environ['RENDER_EXTERNAL_URL']}/{os.environ['TELEGRAM_TOKEN']}"
+    await asyncio.gather(
+        app.bot.set_my_commands([BotCommand("start", "Log progress for an item")]),
+        ensure_webhook(app.bot),
     )
 
-    print("✅ Bot running successfully")
-    await asyncio.Event().wait()
+    log.info("✅ Bot running successfully")
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await runner.cleanup()
+    await app.stop()
+
+    loader.cancel()
+    refresher.cancel()
+    await asyncio.gather(writer, flusher)
+    try:
+        await flush_writes()
+    except Exception as e:
+        log.error("Dropping %d unflushed cell writes: %s", len(_pending_writes), e)
+    try:
+        while _pending_logs or not LOG_QUEUE.empty():
+            await flush_logs()
+    except Exception as e:
+        log.error("Dropping %d unflushed log rows: %s", len(_pending_logs) + LOG_QUEUE.qsize(), e)
+
+    await app.shutdown()
+    _log_listener.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())